@@ -1,15 +1,42 @@
 import streamlit as st
 import pandas as pd
-from sqlalchemy import text # Added text import
+from sqlalchemy import create_engine, text # Added text import
+from sqlalchemy.engine import URL
 from datetime import datetime, timedelta
 import yfinance as yf
+from yfinance.exceptions import YFRateLimitError, YFTickerMissingError
 import numpy as np
+from numba import njit
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 import matplotlib
 import time
+import random
+import threading
+import diskcache
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
   
-market_cap_cache = {}
+TOP_TICKERS_CHART_MAX = 25 # Upper bound of the "Top Tickers" chart slider
+MAX_FETCH_WORKERS = 8 # yfinance calls are network-bound, so threads overlap the round-trips
+PRICE_FETCH_ATTEMPTS = 3
+PRICE_RETRY_BASE_DELAY = 0.35 # Seconds; used until latencies have been observed, doubled on each retry
+PRICE_RETRY_BUDGET = 3.0 # Max total seconds spent sleeping between retries for one ticker
+PRICE_FAST_STREAK = 8 # This many recent fetches under PRICE_FAST_LATENCY means Yahoo is healthy
+PRICE_FAST_LATENCY = 0.2 # Seconds
+price_fetch_latencies = deque(maxlen=32) # Recent successful get_current_price service times (seconds)
+# Shared keep-alive session for all Yahoo/yfinance calls so TLS setup is amortized across tickers
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=32, pool_maxsize=32))
+SESSION.headers.update({'User-Agent': 'Mozilla/5.0'})
+# Persistent on-disk cache shared across sessions/workers; TTLs follow how often each value actually changes
+market_data_cache = diskcache.Cache('.mcap_cache')
+MARKET_CAP_CACHE_TTL = 86400 # Market caps move at most daily
+PERIOD_START_PRICE_CACHE_TTL = 7 * 86400 # Closes for past dates don't change
+DB_DATE_RANGE_CACHE_TTL = 6 * 3600 # Data is ingested once a day
 @st.cache_data(ttl=3600) # Streamlit caching for an hour
 def get_market_cap_st(ticker_symbol):
     if not ticker_symbol or pd.isna(ticker_symbol): # Handle invalid input
@@ -18,89 +45,189 @@ def get_market_cap_st(ticker_symbol):
         
     ticker_symbol_upper = str(ticker_symbol).upper() # Standardize ticker input
 
-    if ticker_symbol_upper in market_cap_cache: # Check manual cache
-        # print(f"DEBUG_MCAP: {ticker_symbol_upper} - Found in manual cache: {market_cap_cache[ticker_symbol_upper]}")
-        return market_cap_cache[ticker_symbol_upper]
+    if (cached_mcap := market_data_cache.get(f"mcap:{ticker_symbol_upper}")) is not None: # Check disk cache
+        # print(f"DEBUG_MCAP: {ticker_symbol_upper} - Found in disk cache: {cached_mcap}")
+        return cached_mcap
     
     print(f"DEBUG_MCAP: --- Attempting yfinance fetch for {ticker_symbol_upper} ---")
     try:
-        ticker_obj = yf.Ticker(ticker_symbol_upper)
+        ticker_obj = yf.Ticker(ticker_symbol_upper, session=SESSION)
         info = ticker_obj.info # This is the main API call here
         
         if not info: # Check if info dictionary is empty or None
             print(f"DEBUG_MCAP: {ticker_symbol_upper} - yfinance .info was empty or None.")
-            market_cap_cache[ticker_symbol_upper] = None
             return None
 
         market_cap = info.get('marketCap') 
         
         if market_cap is not None and market_cap > 0: # Ensure market_cap is a positive number
             print(f"DEBUG_MCAP: {ticker_symbol_upper} - Success! Market Cap: {market_cap}")
-            market_cap_cache[ticker_symbol_upper] = market_cap
+            market_data_cache.set(f"mcap:{ticker_symbol_upper}", market_cap, expire=MARKET_CAP_CACHE_TTL)
             return market_cap
         else:
             quote_type = info.get('quoteType', 'N/A')
             print(f"DEBUG_MCAP: {ticker_symbol_upper} - 'marketCap' key not found, is None, or zero in .info dict. Value: {market_cap}. QuoteType: {quote_type}")
             # To see all available keys if 'marketCap' is missing:
             # print(f"DEBUG_MCAP: {ticker_symbol_upper} - Available .info keys: {list(info.keys())}") 
-            market_cap_cache[ticker_symbol_upper] = None
             return None
     except Exception as e:
         print(f"DEBUG_MCAP: {ticker_symbol_upper} - ERROR during yfinance fetch: {str(e)}")
-        market_cap_cache[ticker_symbol_upper] = None
         return None
 
+def is_not_found_error(error):
+    # 404s (delisted/unknown symbol) won't succeed on retry. Decided from the HTTP status or yfinance's own
+    # exception type only: the message text can contain '404' in a price, URL or timestamp
+    if isinstance(error, YFTickerMissingError):
+        return True
+    return isinstance(error, requests.HTTPError) and getattr(error.response, 'status_code', None) == 404
+
+def is_rate_limited_error(error):
+    # Same rule as is_not_found_error: HTTP status or yfinance's exception type, never the message text
+    if isinstance(error, YFRateLimitError):
+        return True
+    return isinstance(error, requests.HTTPError) and getattr(error.response, 'status_code', None) == 429
+
+def price_retry_delay(attempt, rate_limited=False):
+    # Start at half the mean observed service time, double per retry (again when rate-limited),
+    # with +/-30% jitter so concurrent retries don't hit Yahoo in lockstep
+    base_delay = 0.5 * (sum(price_fetch_latencies) / len(price_fetch_latencies)) if price_fetch_latencies else PRICE_RETRY_BASE_DELAY
+    return base_delay * (2 ** (attempt + (1 if rate_limited else 0))) * random.uniform(0.7, 1.3)
+
+def yahoo_is_responsive():
+    # Recent fetches all fast: an empty result is a real "no price", not a transient failure worth retrying
+    recent = list(price_fetch_latencies)[-PRICE_FAST_STREAK:]
+    return len(recent) == PRICE_FAST_STREAK and max(recent) < PRICE_FAST_LATENCY
+
 @st.cache_data(ttl=300) # Cache for 5 minutes
 def get_current_price(ticker_symbol):
     print(f"Attempting to fetch current price for {ticker_symbol}...")
-    for attempt in range(2): # Try up to 2 times (initial + 1 retry)
+    retry_time_spent = 0.0
+    for attempt in range(PRICE_FETCH_ATTEMPTS):
+        is_last_attempt = attempt == PRICE_FETCH_ATTEMPTS - 1
+        delay = None
         try:
-            ticker = yf.Ticker(ticker_symbol)
+            attempt_start = time.perf_counter()
+            ticker = yf.Ticker(ticker_symbol, session=SESSION)
             price = ticker.fast_info.get('last_price', None)
             if price:
+                price_fetch_latencies.append(time.perf_counter() - attempt_start)
                 print(f"Success (attempt {attempt+1}) for {ticker_symbol} price: {price}")
                 return price
 
             # Fallback if fast_info doesn't work
             tod = ticker.history(period='2d') # Get last two days
             if not tod.empty:
+                price_fetch_latencies.append(time.perf_counter() - attempt_start)
                 price = tod['Close'].iloc[-1]
                 print(f"Success (attempt {attempt+1}) for {ticker_symbol} price (fallback): {price}")
                 return price
 
-            # If no price found, and it's the first attempt, prepare for retry
-            if attempt == 0:
-                print(f"Price not found for {ticker_symbol} on attempt 1. Retrying in 5s...")
-                # st.info(f"Failed to fetch price for {ticker_symbol}, retrying in 1 minute...") # Optional UI feedback
-                time.sleep(5) # Wait 1 minute
-            else: # Second attempt also failed
-                print(f"Price not found for {ticker_symbol} after 2 attempts.")
+            if yahoo_is_responsive():
+                print(f"Price not found for {ticker_symbol}; Yahoo is responding quickly, not retrying.")
+                break
+            if is_last_attempt:
+                print(f"Price not found for {ticker_symbol} after {PRICE_FETCH_ATTEMPTS} attempts.")
+            else:
+                delay = price_retry_delay(attempt)
+                print(f"Price not found for {ticker_symbol} on attempt {attempt+1}. Retrying in {delay:.2f}s...")
 
         except Exception as e:
             print(f"Error fetching current price for {ticker_symbol} (attempt {attempt+1}): {e}")
-            if attempt == 0: # If first attempt fails with an exception
-                print(f"Retrying price fetch for {ticker_symbol} in 60s due to error...")
-                # st.info(f"Error fetching price for {ticker_symbol}, retrying in 1 minute...") # Optional UI
-                time.sleep(15)
-            else: # Second attempt also failed with an exception
-                 print(f"Error fetching current price for {ticker_symbol} after 2 attempts: {e}")
+            if is_not_found_error(e):
+                print(f"{ticker_symbol} not found (404), not retrying.")
+                break
+            if is_last_attempt:
+                print(f"Error fetching current price for {ticker_symbol} after {PRICE_FETCH_ATTEMPTS} attempts: {e}")
+            else:
+                delay = price_retry_delay(attempt, rate_limited=is_rate_limited_error(e))
+                print(f"Retrying price fetch for {ticker_symbol} in {delay:.2f}s due to error...")
+
+        if delay is not None:
+            if retry_time_spent + delay > PRICE_RETRY_BUDGET:
+                print(f"Retry budget ({PRICE_RETRY_BUDGET}s) exhausted for {ticker_symbol}, giving up.")
+                break
+            retry_time_spent += delay
+            time.sleep(delay)
     return None # Return None if all attempts fail
 
-@st.cache_data(ttl=3600)
+def get_current_prices_concurrent(ticker_symbols):
+    # One get_current_price task per ticker, run in parallel over the shared session (network-bound)
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        price_futures = {ticker: executor.submit(get_current_price, ticker) for ticker in ticker_symbols}
+        return {ticker: future.result() for ticker, future in price_futures.items()}
+
+def history_closes(history, ticker):
+    # Close column for one ticker out of a yf.download(group_by='ticker') result
+    if isinstance(history.columns, pd.MultiIndex):
+        if ticker not in history.columns.get_level_values(0):
+            return pd.Series(dtype='float64')
+        return history[ticker]['Close'].dropna()
+    return history['Close'].dropna() # Older yfinance returns flat columns for a single ticker
+
+@st.cache_data(ttl=300) # Cache for 5 minutes
+def fetch_current_prices_batch(ticker_symbols_sorted):
+    # Latest bar for every ticker through yfinance's download layer, which handles Yahoo's cookie/crumb
+    # (the bare v7 quote endpoint answers 401 "Invalid Crumb" without it)
+    prices = {}
+    if not ticker_symbols_sorted:
+        return prices
+    try:
+        history = yf.download(tickers=' '.join(ticker_symbols_sorted), period='1d', group_by='ticker',
+                              threads=True, progress=False, session=SESSION)
+    except Exception as e:
+        print(f"Error fetching batch prices for {len(ticker_symbols_sorted)} symbols: {e}")
+        return prices
+    if history is None or history.empty:
+        return prices
+    for ticker in ticker_symbols_sorted:
+        closes = history_closes(history, ticker)
+        if not closes.empty and closes.iloc[-1]:
+            prices[ticker] = float(closes.iloc[-1])
+    return prices
+
+def get_current_prices_batch(ticker_symbols):
+    # Sorted tuple so the cache key doesn't depend on input order
+    return fetch_current_prices_batch(tuple(sorted(set(ticker_symbols))))
+
+# Only the columns the dashboard uses; ordering is done in pandas where it matters.
+# Plain bound parameters rather than a session-level PREPARE: the configured host is Neon's PgBouncer
+# pooler (transaction mode), which hands each transaction whichever backend is free, so a statement
+# prepared on one backend isn't visible to the next. Server-side plan reuse would need the direct endpoint.
+OPTIONS_RANGE_SELECT_SQL = """
+SELECT underlying_ticker, data_date, expiration_date, strike_price, premium_usd,
+       option_action, option_type, sentiment, market_cap_ingested
+FROM options_activity
+WHERE data_date BETWEEN :start_date AND :end_date;
+"""
+
+@st.cache_resource
+def get_db_engine():
+    """Process-wide pooled engine so queries reuse connections instead of reconnecting each time."""
+    db_secrets = st.secrets["connections"]["postgresql"]
+    drivername = db_secrets.get("dialect", "postgresql")
+    if db_secrets.get("driver"):
+        drivername = f"{drivername}+{db_secrets['driver']}"
+    db_url = URL.create(drivername=drivername, username=db_secrets.get("username"), password=db_secrets.get("password"),
+                        host=db_secrets.get("host"), port=int(db_secrets["port"]) if db_secrets.get("port") else None, database=db_secrets.get("database"))
+    return create_engine(db_url, pool_size=10, max_overflow=10, pool_pre_ping=True)
+
 def get_db_date_range():
+    # Min/max only move when the daily ingestion runs, so persist across sessions on disk with a TTL tied to that cadence
+    if (cached_range := market_data_cache.get("db_date_range")) is not None:
+        return cached_range
     min_db_date, max_db_date = None, None
     try:
-        # engine = create_engine(db_connection_string)
-        conn = st.connection("postgresql", type="sql") 
-        min_max_df = conn.query("SELECT MIN(data_date) as min_val, MAX(data_date) as max_val FROM options_activity;", ttl=0) # ttl=0 for query if outer func is cached
-
-        if not min_max_df.empty:
-            min_val = min_max_df['min_val'].iloc[0]
-            max_val = min_max_df['max_val'].iloc[0]
-            if pd.notna(min_val): 
-                min_db_date = pd.to_datetime(min_val).date()
-            if pd.notna(max_val): 
-                max_db_date = pd.to_datetime(max_val).date()
+        # ORDER BY ... LIMIT 1 on the indexed data_date column is a single index probe at each end
+        with get_db_engine().connect() as conn:
+            min_val = conn.execute(text("SELECT data_date FROM options_activity ORDER BY data_date ASC LIMIT 1;")).scalar()
+            max_val = conn.execute(text("SELECT data_date FROM options_activity ORDER BY data_date DESC LIMIT 1;")).scalar()
+
+        if pd.notna(min_val): 
+            min_db_date = pd.to_datetime(min_val).date()
+        if pd.notna(max_val): 
+            max_db_date = pd.to_datetime(max_val).date()
+        if min_db_date and max_db_date:
+            market_data_cache.set("db_date_range", (min_db_date, max_db_date), expire=DB_DATE_RANGE_CACHE_TTL)
         return min_db_date, max_db_date
     except Exception as e:
         print(f"Error fetching date range from DB: {e}")
@@ -111,94 +238,164 @@ def fetch_options_activity_for_range(start_date, end_date):
     start_date_str = start_date.strftime('%Y-%m-%d') if hasattr(start_date, 'strftime') else str(start_date)
     end_date_str = end_date.strftime('%Y-%m-%d') if hasattr(end_date, 'strftime') else str(end_date)
     try:
-        # engine = create_engine(db_connection_string)
-        conn = st.connection("postgresql", type="sql")
-        query = """
-        SELECT * FROM options_activity 
-        WHERE data_date >= :start_date AND data_date <= :end_date 
-        ORDER BY data_date, underlying_ticker;
-        """
-        df = conn.query(query, params={'start_date': start_date_str, 'end_date': end_date_str}, ttl =0)
+        with get_db_engine().connect() as conn:
+            # Arrow-backed, already-typed columns straight from the driver; only the date columns need parsing
+            df = pd.read_sql_query(text(OPTIONS_RANGE_SELECT_SQL), conn, params={'start_date': start_date_str, 'end_date': end_date_str},
+                                   parse_dates=['data_date', 'expiration_date'], dtype_backend='pyarrow')
         if not df.empty:
-            df['expiration_date'] = pd.to_datetime(df['expiration_date'], errors='coerce')
-            df['data_date'] = pd.to_datetime(df['data_date'], errors='coerce')
-            df['premium_usd'] = pd.to_numeric(df['premium_usd'], errors='coerce').fillna(0)
+            df['premium_usd'] = df['premium_usd'].fillna(0).astype('float32') # Stored as REAL in the DB anyway
+            # Normalize the string columns once here so downstream masks are plain equality checks;
+            # they hold only a handful of distinct values, so category keeps them as small integer codes
+            df['option_type'] = df['option_type'].astype('string[pyarrow]').str.strip().str.upper().astype('category')
+            df['sentiment'] = df['sentiment'].astype('string[pyarrow]').str.strip().str.capitalize().astype('category') # 'Bullish'/'Bearish', as ingested
+            df['underlying_ticker'] = df['underlying_ticker'].astype('string[pyarrow]').str.strip().str.upper().astype('category')
         return df
     except Exception as e:
         st.error(f"Error connecting to DB or fetching data for range {start_date_str}-{end_date_str}: {e}")
         return pd.DataFrame()
 
-def analyze_ticker_dashboard(options_df_for_period, selected_range_start_date_dt):
-    if options_df_for_period.empty:
+def is_missing_relation_error(error):
+    # Postgres "undefined_table" (42P01), e.g. the summary view before the first ingestion run has created it.
+    # pandas re-raises driver errors as its own DatabaseError, so the SQLAlchemy error sits further down the chain
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        db_error = getattr(error, 'orig', None)
+        if (getattr(db_error, 'pgcode', None) or getattr(db_error, 'sqlstate', None)) == '42P01':
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+def daily_ticker_summary_from_rows(options_df):
+    # Same per-day, per-ticker rows as options_daily_ticker_summary, built from fetch_options_activity_for_range output
+    if options_df.empty:
+        return pd.DataFrame()
+    premium = options_df['premium_usd'].astype('float64')
+    option_types, sentiments = options_df['option_type'], options_df['sentiment']
+    daily_rows = pd.DataFrame({
+        'data_date': options_df['data_date'], 'underlying_ticker': options_df['underlying_ticker'].astype('string[pyarrow]'),
+        'total_prem': premium,
+        'call_prem': premium.where(option_types.eq('CALL').to_numpy(dtype=bool, na_value=False), 0),
+        'put_prem': premium.where(option_types.eq('PUT').to_numpy(dtype=bool, na_value=False), 0),
+        'bull_prem': premium.where(sentiments.eq('Bullish').to_numpy(dtype=bool, na_value=False), 0),
+        'bear_prem': premium.where(sentiments.eq('Bearish').to_numpy(dtype=bool, na_value=False), 0),
+        'mcap': options_df['market_cap_ingested']})
+    return daily_rows.groupby(['data_date', 'underlying_ticker'], as_index=False).agg(
+        total_prem=('total_prem', 'sum'), call_prem=('call_prem', 'sum'), put_prem=('put_prem', 'sum'),
+        bull_prem=('bull_prem', 'sum'), bear_prem=('bear_prem', 'sum'), mcap=('mcap', 'max'))
+
+@st.cache_data(ttl=3600)
+def fetch_ticker_summary_for_range(start_date, end_date, ticker_symbol=None):
+    """Per-ticker premium totals for the range, summed from the precomputed options_daily_ticker_summary view (or the raw rows until it exists)."""
+    start_date_str = start_date.strftime('%Y-%m-%d') if hasattr(start_date, 'strftime') else str(start_date)
+    end_date_str = end_date.strftime('%Y-%m-%d') if hasattr(end_date, 'strftime') else str(end_date)
+    params = {'start_date': start_date_str, 'end_date': end_date_str}
+    ticker_filter_sql = ""
+    if ticker_symbol:
+        params['ticker'] = str(ticker_symbol).strip().upper()
+        ticker_filter_sql = "AND underlying_ticker = :ticker" # The view column is already UPPER(TRIM(...)), so this stays index-friendly
+    try:
+        # One row per ticker per day (refreshed by options_analyzer.py after each ingestion)
+        query = f"""
+        SELECT data_date, underlying_ticker, total_prem, call_prem, put_prem, bull_prem, bear_prem, mcap
+        FROM options_daily_ticker_summary
+        WHERE data_date BETWEEN :start_date AND :end_date
+        {ticker_filter_sql};
+        """
+        try:
+            with get_db_engine().connect() as conn:
+                daily_df = pd.read_sql_query(text(query), conn, params=params, dtype_backend='pyarrow')
+        except Exception as e:
+            if not is_missing_relation_error(e):
+                raise
+            # View not created yet (fresh deploy, or no ingestion run since it was added): aggregate the raw rows instead
+            print(f"options_daily_ticker_summary not found; summarizing raw rows for {start_date_str}-{end_date_str}.")
+            options_df = fetch_options_activity_for_range(start_date, end_date)
+            if ticker_symbol and not options_df.empty:
+                options_df = options_df[options_df['underlying_ticker'] == params['ticker']] # Already stripped/upper-cased at fetch time
+            daily_df = daily_ticker_summary_from_rows(options_df)
+        if daily_df.empty:
+            return daily_df
+        premium_cols = ['total_prem', 'call_prem', 'put_prem', 'bull_prem', 'bear_prem']
+        df = daily_df.groupby('underlying_ticker', as_index=False)[premium_cols].sum()
+        df[premium_cols] = df[premium_cols].fillna(0)
+        # mcap is the market cap ingested on the latest day in the range that has one
+        latest_mcaps = daily_df.dropna(subset=['mcap']).sort_values(by='data_date').groupby('underlying_ticker')['mcap'].last()
+        df['mcap'] = df['underlying_ticker'].map(latest_mcaps)
+        return df
+    except Exception as e:
+        st.error(f"Error fetching ticker summary for range {start_date_str}-{end_date_str}: {e}")
+        return pd.DataFrame()
+
+def fetch_period_start_prices(ticker_symbols, start_hist_date):
+    """Fetches the first close on/after start_hist_date for all tickers in one batched yfinance download."""
+    period_start_prices = {}
+    start_date_str = start_hist_date.strftime('%Y-%m-%d')
+    tickers_to_fetch = []
+    for ticker in ticker_symbols:
+        if (cached_price := market_data_cache.get(f"start_close:{ticker}:{start_date_str}")) is not None:
+            period_start_prices[ticker] = cached_price
+        else:
+            tickers_to_fetch.append(ticker)
+    if not tickers_to_fetch:
+        return period_start_prices
+    try:
+        history = yf.download(tickers=' '.join(tickers_to_fetch), start=start_hist_date, end=(start_hist_date + pd.Timedelta(days=4)),
+                              group_by='ticker', threads=True, progress=False, session=SESSION)
+    except Exception as e:
+        print(f"Could not fetch historical prices on {start_date_str}: {e}")
+        return period_start_prices
+    if history is None or history.empty:
+        return period_start_prices
+
+    for ticker in tickers_to_fetch:
+        closes = history_closes(history, ticker)
+        if not closes.empty:
+            period_start_prices[ticker] = float(closes.iloc[0])
+            if start_hist_date.date() < datetime.now().date(): # Today's bar is still moving
+                market_data_cache.set(f"start_close:{ticker}:{start_date_str}", period_start_prices[ticker], expire=PERIOD_START_PRICE_CACHE_TTL)
+    return period_start_prices
+
+def analyze_ticker_dashboard(ticker_summary_df, selected_range_start_date_dt):
+    if ticker_summary_df.empty:
         return pd.DataFrame()
 
     analysis_results = []
-    unique_tickers = sorted(options_df_for_period['underlying_ticker'].unique())
-
-    for ticker in unique_tickers:
-        if not ticker or pd.isna(ticker) or str(ticker).strip().upper() == 'NAN' or not str(ticker).strip():
-            continue
-
-        # Fetch live data first
-        # Initialize current_price to None before the call for safety
-        current_price = None 
-        current_price = get_current_price(ticker) # This function should handle its own errors and return None if failed
-
-        # Use market_cap_ingested from the database records for this ticker within the period
-        ticker_df_for_mcap = options_df_for_period[options_df_for_period['underlying_ticker'] == ticker]
-        market_cap_to_use_for_calc = np.nan # Default to NaN
-
-        if not ticker_df_for_mcap.empty and 'market_cap_ingested' in ticker_df_for_mcap.columns:
-            latest_record_for_ticker = ticker_df_for_mcap.sort_values(by='data_date', ascending=False).iloc[0]
-            mcap_val = latest_record_for_ticker['market_cap_ingested']
-            if pd.notnull(mcap_val): # Ensure it's not NaN before assigning
-                market_cap_to_use_for_calc = mcap_val
-        
+    valid_ticker_mask = ticker_summary_df['underlying_ticker'].notna() & \
+        ~ticker_summary_df['underlying_ticker'].astype(str).str.strip().str.upper().isin(['', 'NAN'])
+    premium_aggs = ticker_summary_df[valid_ticker_mask].set_index('underlying_ticker').sort_index()
+    unique_tickers = list(premium_aggs.index)
+    start_hist_date = pd.to_datetime(selected_range_start_date_dt)
+
+    # Fetch live prices for all tickers up front: one batched download, then per-ticker
+    # fallback in parallel (network-bound) for any symbols it didn't return
+    current_prices = get_current_prices_batch(unique_tickers)
+    missing_price_tickers = [ticker for ticker in unique_tickers if current_prices.get(ticker) is None]
+    if missing_price_tickers:
+        current_prices.update(get_current_prices_concurrent(missing_price_tickers))
+
+    # Phase 1: premium aggregations and MCap scores for every ticker (no network)
+    for ticker, aggs in premium_aggs.iterrows():
+        current_price = current_prices.get(ticker) # get_current_price handles its own errors and returns None if failed
+
         # This is the market cap that will be displayed and used for calculations.
         # If you want a "Live Market Cap" for display as well, you'd call get_market_cap_st(ticker) here.
         # For now, we are using the ingested one as the primary "Market Cap".
-        
+        market_cap_to_use_for_calc = aggs['mcap'] # market_cap_ingested from the latest DB record in the period
         mcap_val_for_calc = market_cap_to_use_for_calc if pd.notnull(market_cap_to_use_for_calc) and market_cap_to_use_for_calc > 0 else 0
-        
-        # --- Premium calculations based on ticker_df_for_mcap (which is options_df_for_period filtered for the ticker) ---
-        ticker_df = ticker_df_for_mcap # Use the already filtered DataFrame
-        total_premium_for_ticker, total_call_premium, total_put_premium, bullish_premium, bearish_premium = 0.0, 0.0, 0.0, 0.0, 0.0
-        if 'premium_usd' in ticker_df.columns and pd.api.types.is_numeric_dtype(ticker_df['premium_usd']):
-            ticker_df_cleaned_premium = ticker_df.dropna(subset=['premium_usd'])
-            total_premium_for_ticker = ticker_df_cleaned_premium['premium_usd'].sum()
-            # Ensure sentiment and option_type columns exist and are handled correctly
-            if 'sentiment' in ticker_df_cleaned_premium.columns:
-                sentiment_series = ticker_df_cleaned_premium['sentiment'].fillna('UNKNOWN').astype(str).str.strip().str.upper()
-                bullish_premium = ticker_df_cleaned_premium.loc[sentiment_series == 'BULLISH', 'premium_usd'].sum()
-                bearish_premium = ticker_df_cleaned_premium.loc[sentiment_series == 'BEARISH', 'premium_usd'].sum()
-            if 'option_type' in ticker_df_cleaned_premium.columns:
-                total_call_premium = ticker_df_cleaned_premium[ticker_df_cleaned_premium['option_type'].str.upper() == 'CALL']['premium_usd'].sum()
-                total_put_premium = ticker_df_cleaned_premium[ticker_df_cleaned_premium['option_type'].str.upper() == 'PUT']['premium_usd'].sum()
+
+        total_premium_for_ticker, total_call_premium, total_put_premium = aggs['total_prem'], aggs['call_prem'], aggs['put_prem']
+        bullish_premium, bearish_premium = aggs['bull_prem'], aggs['bear_prem']
 
         bullish_mcap_Score = (bullish_premium / mcap_val_for_calc) * 100000 if mcap_val_for_calc > 0 else 0
         bearish_mcap_Score = (bearish_premium / mcap_val_for_calc) * 100000 if mcap_val_for_calc > 0 else 0
-        
-        price_at_period_start = np.nan # Initialize
-        price_change_pct = np.nan      # Initialize
-        
-        try:
-            start_hist_date = pd.to_datetime(selected_range_start_date_dt)
-            history = yf.Ticker(ticker).history(start=start_hist_date, end=(start_hist_date + pd.Timedelta(days=4)))
-            if not history.empty:
-                price_at_period_start = history['Close'].iloc[0]
-                # current_price is defined above the try block.
-                if pd.notnull(current_price) and pd.notnull(price_at_period_start) and price_at_period_start != 0:
-                    price_change_pct = ((current_price - price_at_period_start) / price_at_period_start) * 100
-        except Exception as e:
-            # current_price should be defined here, even if None. The f-string will handle None correctly.
-            print(f"Could not fetch historical price for {ticker} (current price: {current_price}) on {selected_range_start_date_dt.strftime('%Y-%m-%d')}: {e}")
 
         analysis_results.append({
             "Ticker": ticker, 
             "Market Cap": market_cap_to_use_for_calc, # Using the ingested/derived market cap
             "Current Price": current_price, # Live fetched
-            "Price at Period Start": price_at_period_start, 
-            "Price Change %": price_change_pct,
+            "Price at Period Start": np.nan, # Filled in phase 2
+            "Price Change %": np.nan,
             "Total Activity Prem": total_premium_for_ticker,
             "Total Call Vol. Prem": total_call_premium,      
             "Total Put Vol. Prem": total_put_premium,        
@@ -207,37 +404,314 @@ def analyze_ticker_dashboard(options_df_for_period, selected_range_start_date_dt
             "Bullish MCap Score": bullish_mcap_Score,
             "Bearish MCap Score": bearish_mcap_Score
         })
-    return pd.DataFrame(analysis_results)
+    analysis_df = pd.DataFrame(analysis_results)
+
+    # Phase 2: period-start prices for every ticker in the table, in one batched request
+    # instead of one history() call per ticker
+    period_start_prices = fetch_period_start_prices(analysis_df['Ticker'].tolist(), start_hist_date)
+    current_price_series = pd.to_numeric(analysis_df['Current Price'], errors='coerce')
+    price_at_period_start = pd.to_numeric(analysis_df['Ticker'].map(period_start_prices), errors='coerce')
+    analysis_df['Price at Period Start'] = price_at_period_start
+    analysis_df['Price Change %'] = ((current_price_series - price_at_period_start) / price_at_period_start.where(price_at_period_start != 0)) * 100
+    return analysis_df
+
+@njit(cache=True)
+def expiration_sums_kernel(exp_days, premium, is_call, is_put, is_bull, is_bear, ticker_codes, n_tickers):
+    # Inputs are sorted by exp_days; one output row per run of equal expiry days.
+    # sums columns: total, call, put, bullish, bearish premium
+    n_rows = exp_days.shape[0]
+    n_runs = 0
+    for i in range(n_rows):
+        if i == 0 or exp_days[i] != exp_days[i - 1]:
+            n_runs += 1
+    run_days = np.empty(n_runs, np.int64)
+    sums = np.zeros((n_runs, 5), np.float64)
+    counts = np.zeros(n_runs, np.int64)
+    unique_counts = np.zeros(n_runs, np.int64)
+    last_run_seen = np.full(n_tickers, -1, np.int64) # Per ticker code, the last run it was counted in
+    run = -1
+    for i in range(n_rows):
+        if i == 0 or exp_days[i] != exp_days[i - 1]:
+            run += 1
+            run_days[run] = exp_days[i]
+        prem = premium[i]
+        sums[run, 0] += prem
+        if is_call[i]: sums[run, 1] += prem
+        if is_put[i]: sums[run, 2] += prem
+        if is_bull[i]: sums[run, 3] += prem
+        if is_bear[i]: sums[run, 4] += prem
+        code = ticker_codes[i]
+        if code >= 0: # Missing tickers count toward neither the options count nor unique tickers
+            counts[run] += 1
+            if last_run_seen[code] != run:
+                last_run_seen[code] = run
+                unique_counts[run] += 1
+    return run_days, sums, counts, unique_counts
 
 def create_expiration_summary_table(options_df_for_period):
     if options_df_for_period.empty or not all(col in options_df_for_period.columns for col in ['expiration_date', 'premium_usd', 'underlying_ticker', 'option_type', 'sentiment']):
         return pd.DataFrame()
-    summary_df = options_df_for_period.copy()
-    summary_df['expiration_date'] = pd.to_datetime(summary_df['expiration_date'], errors='coerce')
-    summary_df.dropna(subset=['expiration_date', 'premium_usd'], inplace=True)
-    if summary_df.empty: return pd.DataFrame()
-    today_date = pd.to_datetime(datetime.now().date())
-    summary_df['time_to_expiry_days'] = (summary_df['expiration_date'] - today_date).dt.days
-    summary_df['call_premium_exp'] = np.where(summary_df['option_type'] == 'CALL', summary_df['premium_usd'], 0)
-    summary_df['put_premium_exp'] = np.where(summary_df['option_type'] == 'PUT', summary_df['premium_usd'], 0)
-    summary_df['bullish_premium_exp'] = np.where(summary_df['sentiment'] == 'Bullish', summary_df['premium_usd'], 0)
-    summary_df['bearish_premium_exp'] = np.where(summary_df['sentiment'] == 'Bearish', summary_df['premium_usd'], 0)
-    expiration_analysis = summary_df.groupby(['expiration_date', 'time_to_expiry_days']).agg(
-        total_premium_expiring=('premium_usd', 'sum'), unique_tickers_expiring=('underlying_ticker', 'nunique'),
-        total_call_premium_expiring=('call_premium_exp', 'sum'), total_put_premium_expiring=('put_premium_exp', 'sum'),
-        total_bullish_premium_expiring=('bullish_premium_exp', 'sum'), total_bearish_premium_expiring=('bearish_premium_exp', 'sum'),
-        number_of_options=('underlying_ticker', 'count')).reset_index()
-    expiration_analysis.sort_values(by='time_to_expiry_days', ascending=True, inplace=True)
-    expiration_analysis.rename(columns={
-        'expiration_date': 'Expiration Date', 'time_to_expiry_days': 'Days to Expiry',
-        'total_premium_expiring': 'Total Premium', 'unique_tickers_expiring': 'Unique Tickers',
-        'total_call_premium_expiring': 'Call Premium', 'total_put_premium_expiring': 'Put Premium',
-        'total_bullish_premium_expiring': 'Bullish Premium', 'total_bearish_premium_expiring': 'Bearish Premium',
-        'number_of_options': 'Options Count'}, inplace=True)
-    return expiration_analysis
+    expiration_dates = options_df_for_period['expiration_date']
+    if not pd.api.types.is_datetime64_any_dtype(expiration_dates):
+        expiration_dates = pd.to_datetime(expiration_dates, errors='coerce')
+    valid_rows = (expiration_dates.notna() & options_df_for_period['premium_usd'].notna()).to_numpy(dtype=bool, na_value=False)
+    if not valid_rows.any(): return pd.DataFrame()
+
+    # Contiguous numpy inputs for the JIT kernel, sorted by expiry day
+    exp_days = expiration_dates[valid_rows].to_numpy(dtype='datetime64[ns]').astype('datetime64[D]').astype(np.int64)
+    order = np.argsort(exp_days, kind='stable')
+    exp_days = exp_days[order]
+    premium = options_df_for_period['premium_usd'][valid_rows].to_numpy(dtype=np.float64)[order] # Sum in float64 even though the raw column is float32
+    option_types = options_df_for_period['option_type'][valid_rows]
+    sentiments = options_df_for_period['sentiment'][valid_rows]
+    is_call = option_types.eq('CALL').to_numpy(dtype=bool, na_value=False)[order]
+    is_put = option_types.eq('PUT').to_numpy(dtype=bool, na_value=False)[order]
+    is_bull = sentiments.eq('Bullish').to_numpy(dtype=bool, na_value=False)[order]
+    is_bear = sentiments.eq('Bearish').to_numpy(dtype=bool, na_value=False)[order]
+    tickers = options_df_for_period['underlying_ticker'][valid_rows]
+    if isinstance(tickers.dtype, pd.CategoricalDtype):
+        ticker_codes, n_tickers = tickers.cat.codes.to_numpy(dtype=np.int64), len(tickers.cat.categories)
+    else:
+        ticker_codes, ticker_uniques = pd.factorize(tickers)
+        ticker_codes, n_tickers = ticker_codes.astype(np.int64), len(ticker_uniques)
+
+    run_days, sums, counts, unique_counts = expiration_sums_kernel(
+        exp_days, premium, is_call, is_put, is_bull, is_bear, ticker_codes[order], n_tickers)
+
+    today_day = np.datetime64(datetime.now().date(), 'D').astype(np.int64)
+    return pd.DataFrame({
+        'Expiration Date': pd.to_datetime(run_days, unit='D'), 'Days to Expiry': run_days - today_day,
+        'Total Premium': sums[:, 0], 'Unique Tickers': unique_counts,
+        'Call Premium': sums[:, 1], 'Put Premium': sums[:, 2],
+        'Bullish Premium': sums[:, 3], 'Bearish Premium': sums[:, 4],
+        'Options Count': counts})
+
+def downcast_for_display(df):
+    # float32 values and second-resolution dates (pandas' coarsest datetime unit) halve what
+    # Arrow serialization and Plotly's JSON encoding have to push to the browser.
+    # Only for chart payloads and raw rows: float32 keeps ~7 significant digits, too few for dollar totals
+    float_cols = [col for col in df.columns if pd.api.types.is_float_dtype(df[col].dtype)]
+    date_cols = [col for col in df.columns if pd.api.types.is_datetime64_dtype(df[col].dtype)]
+    return df.astype({**dict.fromkeys(float_cols, 'float32'), **dict.fromkeys(date_cols, 'datetime64[s]')})
+
+def fmt_money(values):
+    # Whole-dollar currency strings for a numeric Series; missing values render as "$0"
+    return values.fillna(0).map("${:,.0f}".format)
+
+def fmt_expiry_date(dates):
+    # 'YYYY-MM-DD (Ddd)' labels; strftime runs once per distinct expiry rather than once per row
+    dates = dates if pd.api.types.is_datetime64_any_dtype(dates) else pd.to_datetime(dates)
+    unique_dates = dates.drop_duplicates()
+    return dates.map(dict(zip(unique_dates, unique_dates.dt.strftime('%Y-%m-%d (%a)'))))
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def format_exp_summary(expiration_summary_df):
+    # Display strings for the expiration table; hashed on content, so reruns with unchanged filters reuse it.
+    # Built column by column: formatted columns are new string Series, the rest are passed through uncopied
+    formatters = {**dict.fromkeys(EXP_MONEY_COLS, fmt_money), 'Expiration Date': fmt_expiry_date}
+    return pd.DataFrame({col_name: formatters[col_name](expiration_summary_df[col_name]) if col_name in formatters else expiration_summary_df[col_name]
+                         for col_name in FINAL_EXP_COLS if col_name in expiration_summary_df.columns}, copy=False)
+
+# --- Rerun caches keyed on a cheap explicit key (leading-underscore args are not hashed by Streamlit) ---
+def view_cache_key(options_df, *context):
+    # Filters that produced the frame plus a cheap fingerprint of it, instead of hashing every row.
+    # The latest data_date and the premium total change when a range is re-ingested, even if the row count doesn't
+    fingerprint_cols = ('expiration_date', 'data_date', 'premium_usd')
+    if options_df.empty or not all(col in options_df.columns for col in fingerprint_cols):
+        return (*context, len(options_df))
+    return (*context, len(options_df), str(options_df['expiration_date'].min()), str(options_df['expiration_date'].max()),
+            str(options_df['data_date'].max()), float(options_df['premium_usd'].astype('float64').sum()))
+
+@st.cache_data(show_spinner=False, ttl=600)
+def get_expiration_summary(cache_key, _options_df_for_period):
+    return create_expiration_summary_table(_options_df_for_period)
+
+@st.cache_data(show_spinner=False, ttl=600)
+def get_top_tickers_by_metric(cache_key, _ticker_analysis_df, metric_col, top_n):
+    return _ticker_analysis_df.dropna(subset=[metric_col]).sort_values(by=metric_col, ascending=False).head(top_n)
+
+# Shared figure layout (layered on plotly's default template) and one chart config for every st.plotly_chart
+# Bars are drawn without outlines, which saves the browser one stroke per bar
+pio.templates["opt"] = go.layout.Template(layout=dict(margin=dict(l=30, r=10, t=40, b=30), bargap=0.15),
+                                          data=dict(bar=[go.Bar(marker_line_width=0)]))
+pio.templates.default = "plotly+opt"
+pio.json.config.default_engine = 'orjson' # Encodes the numpy arrays inside figures natively, much faster than stdlib json
+PLOTLY_CONFIG = {"displaylogo": False, "responsive": True}
+# Fixed-size expiration chart panels (margins come from the "opt" template): with autosize off, Plotly skips
+# its resize/re-layout pass in the browser. 800px fits the main column on laptop viewports with the sidebar open
+CHART_PANEL_LAYOUT = dict(autosize=False, width=800, height=320)
+WEBGL_EXPIRY_THRESHOLD = 50 # Above this many expiries, the total-premium chart switches to WebGL markers
+# Expiration summary table layout
+FINAL_EXP_COLS = ('Expiration Date', 'Days to Expiry', 'Total Premium', 'Options Count', 'Unique Tickers', 'Call Premium', 'Put Premium', 'Bullish Premium', 'Bearish Premium')
+EXP_MONEY_COLS = ('Total Premium', 'Call Premium', 'Put Premium', 'Bullish Premium', 'Bearish Premium')
+# Columns shown in the Raw Data table (the rest are internal to the calculations)
+RAW_DATA_COLS = ['data_date', 'underlying_ticker', 'expiration_date', 'strike_price', 'option_type', 'option_action', 'premium_usd', 'sentiment']
+
+# --- Chart builders (cached on a content hash of their input, so unchanged data skips figure construction) ---
+def hash_dataframe(df):
+    return pd.util.hash_pandas_object(df, index=False).values.tobytes()
+
+chart_cache = st.cache_data(hash_funcs={pd.DataFrame: hash_dataframe}, ttl=3600)
+
+def binned_histogram(values, nbins, title, xaxis_title):
+    # Bin in numpy and ship only nbins bars to the browser, regardless of row count
+    counts, edges = np.histogram(values, bins=nbins)
+    fig = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges),
+                           customdata=np.column_stack([edges[:-1], edges[1:]]),
+                           hovertemplate="%{customdata[0]:,.0f} - %{customdata[1]:,.0f}<br>count=%{y}<extra></extra>"))
+    fig.update_layout(title=title, xaxis_title=xaxis_title, yaxis_title="count", bargap=0)
+    return fig
+
+@chart_cache
+def build_prem_hist(df):
+    return binned_histogram(df['premium_usd'].dropna().to_numpy(dtype=np.float64), 30, "Distribution of Premium Sizes ($)", "premium_usd")
+
+@chart_cache
+def build_dte_hist(df, today_date):
+    expiration_dates = pd.to_datetime(df['expiration_date'], errors='coerce').dropna()
+    if expiration_dates.empty:
+        return None
+    dte_values = (expiration_dates - pd.to_datetime(today_date)).dt.days.to_numpy(dtype=np.float64)
+    return binned_histogram(dte_values, 30, "Distribution of DTE (from today)", "DTE")
+
+@chart_cache
+def build_sentiment_pie(df):
+    # premium_usd is stored as float32; dollar totals are summed in float64 so they stay exact
+    sentiment_summary_for_pie = df['premium_usd'].astype('float64').groupby(df['sentiment'], observed=True).sum().reset_index()
+    if sentiment_summary_for_pie.empty or not sentiment_summary_for_pie['premium_usd'].sum() > 0:
+        return None
+    return px.pie(sentiment_summary_for_pie, values='premium_usd', names='sentiment', title="Premium by Sentiment in Period", color_discrete_map={'Bullish':'green', 'Bearish':'red', 'Unknown':'grey'})
+
+# --- Cache warm-up ---
+def warm_caches():
+    # Pre-populate the caches the default (latest data day) view reads, so the first interaction is served warm
+    try:
+        _, max_db_date = get_db_date_range()
+        if not max_db_date:
+            return
+        fetch_options_activity_for_range(max_db_date, max_db_date)
+        ticker_summary_df = fetch_ticker_summary_for_range(max_db_date, max_db_date, None)
+        # Run the same analysis the default view does, so the quote batch is cached under the exact
+        # ticker tuple that view will ask for (plus its per-ticker fallbacks and period-start closes)
+        analyze_ticker_dashboard(ticker_summary_df, pd.to_datetime(max_db_date))
+        print(f"Cache warm-up finished for {max_db_date}.")
+    except Exception as e:
+        print(f"Cache warm-up failed: {e}")
+
+@st.cache_resource(show_spinner=False)
+def start_cache_warmer():
+    # cache_resource makes this run once per server process rather than once per session
+    warmer_thread = threading.Thread(target=warm_caches, daemon=True)
+    warmer_thread.start()
+    return warmer_thread
+
+def expiry_series_bar(expiration_summary_df, series_colors, title, legend_title):
+    # One bar trace per column, stacked like px.bar(color=...), without melting to long format first
+    fig = go.Figure()
+    expiry_dates = expiration_summary_df['Expiration Date'].to_numpy() # Shared x buffer for every trace
+    for name, color in series_colors:
+        fig.add_bar(x=expiry_dates, y=expiration_summary_df[name].to_numpy(), name=name, marker_color=color)
+    fig.update_layout(title=title, barmode='relative', xaxis_title='Expiration Date', yaxis_title='Premium', legend_title_text=legend_title, **CHART_PANEL_LAYOUT)
+    return fig
+
+def bar_chart(df, y, title, color=None, x='Expiration Date', xaxis_title=None, hover_cols=()):
+    # Single go.Bar trace for a known schema; skips px.bar's per-call column introspection
+    hover_lines = ''.join(f'<br>{col_name}: %{{customdata[{i}]:,}}' for i, col_name in enumerate(hover_cols))
+    fig = go.Figure(go.Bar(x=df[x].to_numpy(), y=df[y].to_numpy(), marker_color=color,
+                           customdata=df[list(hover_cols)].to_numpy() if hover_cols else None,
+                           hovertemplate=f'%{{x}}<br>{y}: %{{y:,}}{hover_lines}<extra></extra>'))
+    fig.update_layout(title=title, xaxis_title=xaxis_title or x, yaxis_title=y)
+    return fig
+
+def total_premium_expiry_chart(expiration_summary_df):
+    if len(expiration_summary_df) <= WEBGL_EXPIRY_THRESHOLD:
+        fig = bar_chart(expiration_summary_df, 'Total Premium', "Total Premium by Expiration Date")
+    else:
+        fig = px.scatter(expiration_summary_df[['Expiration Date', 'Total Premium']], x="Expiration Date", y="Total Premium", render_mode='webgl')
+        fig.update_layout(title="Total Premium by Expiration Date")
+    fig.update_layout(**CHART_PANEL_LAYOUT)
+    return fig
+
+def net_sentiment_expiry_bar(expiration_summary_df):
+    # One trace for both sentiments: bar height is the net premium, colour says which side dominates
+    bullish = expiration_summary_df['Bullish Premium'].to_numpy()
+    bearish = expiration_summary_df['Bearish Premium'].to_numpy()
+    fig = go.Figure(go.Bar(x=expiration_summary_df['Expiration Date'].to_numpy(), y=bullish - bearish,
+                           marker_color=np.where(bullish > bearish, 'green', 'red'), customdata=np.column_stack((bullish, bearish)),
+                           hovertemplate='%{x}<br>Bullish: $%{customdata[0]:,.0f}<br>Bearish: $%{customdata[1]:,.0f}<extra></extra>'))
+    fig.update_layout(title='Net Bullish vs. Bearish Premium by Expiry', xaxis_title='Expiration Date', yaxis_title='Bullish - Bearish Premium', **CHART_PANEL_LAYOUT)
+    return fig
+
+# --- Page sections rendered as fragments: a widget inside one reruns only that section, not the whole script ---
+@st.fragment
+def render_top_tickers_chart(ticker_analysis_df, cache_key):
+    st.markdown("---")
+    # Ensure 'Bullish MCap Score' exists and is numeric in original for charting
+    if "Bullish MCap Score" in ticker_analysis_df.columns:
+        chart_metric_col = "Bullish MCap Score"
+        ticker_analysis_df[chart_metric_col] = pd.to_numeric(ticker_analysis_df[chart_metric_col], errors='coerce')
+
+        top_n_Score = st.slider(f"Number of Top Tickers to Chart ({chart_metric_col}):", 
+                                  min_value=5, max_value=TOP_TICKERS_CHART_MAX, value=10, 
+                                  key="top_n_bullish_Score_slider")
+
+        df_sorted_for_Score_chart = get_top_tickers_by_metric(cache_key, ticker_analysis_df, chart_metric_col, top_n_Score)
+
+        if not df_sorted_for_Score_chart.empty:
+            fig_top_tickers_Score = bar_chart(df_sorted_for_Score_chart, chart_metric_col,
+                                              f"Top {top_n_Score} Tickers by {chart_metric_col}",
+                                              x="Ticker", xaxis_title='Ticker Symbol',
+                                              hover_cols=('Bullish Prem', 'Market Cap'))
+            st.plotly_chart(fig_top_tickers_Score, use_container_width=True, theme=None, config=PLOTLY_CONFIG) # Autosized: tracks the container width
+        else:
+            st.caption(f"Not enough data to display Top Tickers by {chart_metric_col} chart.")
+
+@st.fragment
+def render_expiration_section(view_data, cache_key, searched_ticker):
+    expiration_title = f"Expiration Date Summaries & Charts{f' for {searched_ticker}' if searched_ticker else ' (Selected Period)'}"
+    with st.expander(expiration_title, expanded=False):
+        expiration_summary_df = get_expiration_summary(cache_key, view_data)
+        if not expiration_summary_df.empty:
+            # Charts first, from a float32 copy of the summary (the table below is formatted from the float64 sums)
+            chart_summary_df = downcast_for_display(expiration_summary_df)
+            if 'Expiration Date' in chart_summary_df.columns: # Check if valid for x-axis
+                # One tab per chart: the browser only lays out the chart in the active tab
+                tab_total, tab_cp, tab_sent, tab_count = st.tabs(["Total", "Call/Put", "Sentiment", "Count"])
+                with tab_total:
+                    fig_total_prem_exp = total_premium_expiry_chart(chart_summary_df)
+                    st.plotly_chart(fig_total_prem_exp, use_container_width=False, theme=None, config=PLOTLY_CONFIG)
+                with tab_cp:
+                    fig_cp_expiry = expiry_series_bar(chart_summary_df, (('Call Premium', 'mediumspringgreen'), ('Put Premium', 'salmon')), 'Call vs. Put Premium by Expiry', 'Option Type')
+                    st.plotly_chart(fig_cp_expiry, use_container_width=False, theme=None, config=PLOTLY_CONFIG)
+                with tab_sent:
+                    fig_sent_expiry = net_sentiment_expiry_bar(chart_summary_df)
+                    st.plotly_chart(fig_sent_expiry, use_container_width=False, theme=None, config=PLOTLY_CONFIG)
+                with tab_count:
+                    fig_count_expiry = bar_chart(chart_summary_df, 'Options Count', "Options Count by Expiration Date").update_layout(**CHART_PANEL_LAYOUT)
+                    st.plotly_chart(fig_count_expiry, use_container_width=False, theme=None, config=PLOTLY_CONFIG)
+
+            # Then display the formatted table
+            # (from the float64 expiration_summary_df, so whole-dollar amounts stay exact)
+            display_exp_summary_df = format_exp_summary(expiration_summary_df)
+
+            display_exp_cols = frozenset(display_exp_summary_df.columns) # Hash-set membership instead of scanning the Index per column
+            final_columns_exp = tuple(col for col in FINAL_EXP_COLS if col in display_exp_cols)
+            st.dataframe(display_exp_summary_df.loc[:, list(final_columns_exp)], use_container_width=True, hide_index=True)
+        else:
+            st.info("No expiration summary to display based on current filters.")
+
+@st.fragment
+def render_raw_data_section(view_data, searched_ticker):
+    raw_data_title = f"Raw Options Data{f' for {searched_ticker}' if searched_ticker else ' (Selected Period)'}"
+    with st.expander(raw_data_title, expanded=False): # Collapsed by default
+        # Expander bodies run (and the frame gets serialized) even when collapsed, so only render on request
+        if st.checkbox("Load raw data", key="raw_data_shown"):
+            raw_rows_to_show = st.number_input("Rows to show", min_value=1, max_value=max(len(view_data), 1), value=min(1000, max(len(view_data), 1)), step=500, key="raw_data_rows")
+            st.dataframe(downcast_for_display(view_data.loc[:, [col for col in RAW_DATA_COLS if col in view_data.columns]].head(int(raw_rows_to_show))), use_container_width=True)
 
 # --- Streamlit App Layout ---
 st.set_page_config(layout="wide")
+start_cache_warmer()
    
 col_title, col_attribution = st.columns([0.1, 0.1]) # Adjust ratios as needed (e.g., 3:1)
 
@@ -353,7 +827,7 @@ view_data = options_data.copy()
 if searched_ticker:
     if 'underlying_ticker' in view_data.columns:
         original_row_count = len(view_data)
-        view_data = view_data[view_data['underlying_ticker'].str.upper() == searched_ticker]
+        view_data = view_data[view_data['underlying_ticker'] == searched_ticker] # Already upper-cased at fetch time
         if view_data.empty and original_row_count > 0:
             st.warning(f"No data found for ticker '{searched_ticker}' within the selected date range.")
     elif not view_data.empty : 
@@ -378,7 +852,7 @@ else:
     try:
         snapshot_title = f"Overall Activity Snapshot{f' for {searched_ticker}' if searched_ticker else ' (Selected Period)'}"
         with st.expander(snapshot_title, expanded=True):
-            total_premium = view_data['premium_usd'].sum()
+            total_premium = view_data['premium_usd'].astype('float64').sum() # float64 accumulator: float32 drifts by tens of dollars at this scale
             num_tickers = view_data['underlying_ticker'].nunique()
             num_trades = len(view_data)
             col1, col2, col3 = st.columns(3)
@@ -396,23 +870,18 @@ else:
                 col_chart1, col_chart2 = st.columns(2)
                 with col_chart1:
                     if 'premium_usd' in view_data.columns:
-                        fig_prem_size = px.histogram(view_data.dropna(subset=['premium_usd']), x="premium_usd", nbins=30, title="Distribution of Premium Sizes ($)")
-                        st.plotly_chart(fig_prem_size, use_container_width=True)
+                        fig_prem_size = build_prem_hist(view_data[['premium_usd']])
+                        st.plotly_chart(fig_prem_size, use_container_width=True, theme=None, config=PLOTLY_CONFIG)
                 with col_chart2:
                     if 'expiration_date' in view_data.columns:
-                        view_data_for_dte = view_data.copy()
-                        view_data_for_dte['expiration_date'] = pd.to_datetime(view_data_for_dte['expiration_date'], errors='coerce')
-                        view_data_for_dte.dropna(subset=['expiration_date'], inplace=True)
-                        if not view_data_for_dte.empty:
-                            view_data_for_dte['DTE'] = (view_data_for_dte['expiration_date'] - pd.to_datetime(datetime.now().date())).dt.days
-                            fig_dte = px.histogram(view_data_for_dte.dropna(subset=['DTE']), x="DTE", nbins=30, title="Distribution of DTE (from today)")
-                            st.plotly_chart(fig_dte, use_container_width=True)
+                        fig_dte = build_dte_hist(view_data[['expiration_date']], datetime.now().date())
+                        if fig_dte is not None:
+                            st.plotly_chart(fig_dte, use_container_width=True, theme=None, config=PLOTLY_CONFIG)
                 
                 if 'sentiment' in view_data.columns and 'premium_usd' in view_data.columns:
-                    sentiment_summary_for_pie = view_data.groupby('sentiment')['premium_usd'].sum().reset_index()
-                    if not sentiment_summary_for_pie.empty and sentiment_summary_for_pie['premium_usd'].sum() > 0 :
-                        fig_sentiment_pie = px.pie(sentiment_summary_for_pie, values='premium_usd', names='sentiment', title="Premium by Sentiment in Period", color_discrete_map={'Bullish':'green', 'Bearish':'red', 'Unknown':'grey'})
-                        st.plotly_chart(fig_sentiment_pie, use_container_width=True)
+                    fig_sentiment_pie = build_sentiment_pie(view_data[['sentiment', 'premium_usd']])
+                    if fig_sentiment_pie is not None:
+                        st.plotly_chart(fig_sentiment_pie, use_container_width=True, theme=None, config=PLOTLY_CONFIG)
         
 
     # --- Per-Ticker Analysis ---
@@ -422,8 +891,9 @@ else:
             st.info("No data available to conduct per-ticker analysis based on current filters.")
         else:
             with st.spinner(f"Analyzing data... Fetching market info..."):
-                # Pass selected_start_date (as datetime object) for historical price context
-                ticker_analysis_df = analyze_ticker_dashboard(view_data, pd.to_datetime(selected_start_date)) 
+                # Premium totals are aggregated in the DB; pass selected_start_date (as datetime object) for historical price context
+                ticker_summary_df = fetch_ticker_summary_for_range(selected_start_date, selected_end_date, searched_ticker or None)
+                ticker_analysis_df = analyze_ticker_dashboard(ticker_summary_df, pd.to_datetime(selected_start_date)) 
             
             if not ticker_analysis_df.empty:
                 # 1. Define the new desired column order
@@ -496,72 +966,15 @@ else:
                 # 7. Chart: Top N Tickers 
                 #    This chart should now ideally use "Bullish MCap Score" or let user choose
                 if not searched_ticker and not ticker_analysis_df.empty: # Use original ticker_analysis_df for numeric data
-                    st.markdown("---")
-                    # Ensure 'Bullish MCap Score' exists and is numeric in original for charting
-                    if "Bullish MCap Score" in ticker_analysis_df.columns:
-                        chart_metric_col = "Bullish MCap Score"
-                        ticker_analysis_df[chart_metric_col] = pd.to_numeric(ticker_analysis_df[chart_metric_col], errors='coerce')
-    
-                        top_n_Score = st.slider(f"Number of Top Tickers to Chart ({chart_metric_col}):", 
-                                                  min_value=5, max_value=25, value=10, 
-                                                  key="top_n_bullish_Score_slider")
-                        
-                        df_sorted_for_Score_chart = ticker_analysis_df.dropna(subset=[chart_metric_col]).sort_values(
-                            by=chart_metric_col, ascending=False
-                        ).head(top_n_Score)
-                        
-                        if not df_sorted_for_Score_chart.empty:
-                            fig_top_tickers_Score = px.bar(df_sorted_for_Score_chart, 
-                                                         x="Ticker", 
-                                                         y=chart_metric_col, 
-                                                         title=f"Top {top_n_Score} Tickers by {chart_metric_col}",
-                                                         hover_data=['Bullish Prem', 'Market Cap'], 
-                                                         labels={chart_metric_col: chart_metric_col, 'Ticker': 'Ticker Symbol'})
-                            st.plotly_chart(fig_top_tickers_Score, use_container_width=True)
-                        else:
-                            st.caption(f"Not enough data to display Top Tickers by {chart_metric_col} chart.")
+                    render_top_tickers_chart(ticker_analysis_df, view_cache_key(view_data, selected_start_date, selected_end_date, searched_ticker))
             else:
                 st.info("No detailed ticker analysis to display based on current filters.")
 
     # --- Expiration Summary Table & Charts ---
-    expiration_title = f"Expiration Date Summaries & Charts{f' for {searched_ticker}' if searched_ticker else ' (Selected Period)'}"
-    with st.expander(expiration_title, expanded=False):
-        expiration_summary_df = create_expiration_summary_table(view_data)
-        if not expiration_summary_df.empty:
-            # Charts first (using numeric data from expiration_summary_df)
-            if 'Expiration Date' in expiration_summary_df.columns: # Check if valid for x-axis
-                fig_total_prem_exp = px.bar(expiration_summary_df, x="Expiration Date", y="Total Premium", title="Total Premium by Expiration Date")
-                st.plotly_chart(fig_total_prem_exp, use_container_width=True)
-                
-                df_melted_cp_exp = expiration_summary_df.melt(id_vars=['Expiration Date'], value_vars=['Call Premium', 'Put Premium'], var_name='Option Type', value_name='Premium')
-                fig_cp_expiry = px.bar(df_melted_cp_exp, x='Expiration Date', y='Premium', color='Option Type', title='Call vs. Put Premium by Expiry', color_discrete_map={'Call Premium': 'mediumspringgreen', 'Put Premium': 'salmon'})
-                st.plotly_chart(fig_cp_expiry, use_container_width=True)
-
-                df_melted_sent_exp = expiration_summary_df.melt(id_vars=['Expiration Date'], value_vars=['Bullish Premium', 'Bearish Premium'], var_name='Sentiment Type', value_name='Premium')
-                fig_sent_expiry = px.bar(df_melted_sent_exp, x='Expiration Date', y='Premium', color='Sentiment Type', title='Bullish vs. Bearish Premium by Expiry', color_discrete_map={'Bullish Premium': 'green', 'Bearish Premium': 'red'})
-                st.plotly_chart(fig_sent_expiry, use_container_width=True)
-
-                fig_count_expiry = px.bar(expiration_summary_df, x="Expiration Date", y="Options Count", title="Options Count by Expiration Date")
-                st.plotly_chart(fig_count_expiry, use_container_width=True)
-
-            # Then display the formatted table
-            display_exp_summary_df = expiration_summary_df.copy()
-            if 'Expiration Date' in display_exp_summary_df.columns:
-                display_exp_summary_df['Expiration Date'] = pd.to_datetime(display_exp_summary_df['Expiration Date']).dt.strftime('%Y-%m-%d (%a)')
-            for col_name in ['Total Premium', 'Call Premium', 'Put Premium', 'Bullish Premium', 'Bearish Premium']:
-                if col_name in display_exp_summary_df.columns:
-                    display_exp_summary_df[col_name] = display_exp_summary_df[col_name].apply(lambda x: f"${x:,.0f}" if pd.notnull(x) else "$0")
-            
-            columns_to_display_exp = ['Expiration Date', 'Days to Expiry', 'Total Premium', 'Options Count', 'Unique Tickers', 'Call Premium', 'Put Premium', 'Bullish Premium', 'Bearish Premium']
-            final_columns_exp = [col for col in columns_to_display_exp if col in display_exp_summary_df.columns]
-            st.dataframe(display_exp_summary_df[final_columns_exp].reset_index(drop=True), use_container_width=True)
-        else:
-            st.info("No expiration summary to display based on current filters.")
+    render_expiration_section(view_data, view_cache_key(view_data, selected_start_date, selected_end_date, searched_ticker), searched_ticker)
 
     # --- Raw Data Display ---
-    raw_data_title = f"Raw Options Data{f' for {searched_ticker}' if searched_ticker else ' (Selected Period)'}"
-    with st.expander(raw_data_title, expanded=False): # Collapsed by default
-        st.dataframe(view_data, use_container_width=True)
+    render_raw_data_section(view_data, searched_ticker)
 
 st.sidebar.markdown("---")
 st.sidebar.markdown("Provisional Dashboard - Data from `yfinance` is subject to its terms and can have delays.")
@@ -96,12 +96,73 @@ def create_options_activity_table(engine): # Takes SQLAlchemy engine
                 UNIQUE (data_date, underlying_ticker, strike_price, expiration_date, option_action, option_type, sentiment, premium_usd)
             );
             """))
+            # The UNIQUE constraint's btree already leads with data_date and serves the dashboard's range scans;
+            # drop the near-table-sized covering index an earlier version created alongside it
+            connection.execute(sql_text("DROP INDEX IF EXISTS idx_options_date_ticker;"))
             print("Table 'options_activity' checked/created successfully.")
             connection.commit()
     except Exception as e:
         print(f"Error creating supporting tables: {e}")
         raise
 
+def create_daily_ticker_summary_view(engine): # Takes SQLAlchemy engine
+    """Creates the per-day, per-ticker premium summary the dashboard reads from, if it doesn't exist."""
+    try:
+        with engine.connect() as connection:
+            # Rebuild views from older definitions: grouped on the raw ticker column, or summing the REAL
+            # premium column as float4 (which rounds dollar totals to ~7 significant digits)
+            existing_definition = connection.execute(sql_text(
+                "SELECT definition FROM pg_matviews WHERE matviewname = 'options_daily_ticker_summary';")).scalar()
+            # (Postgres 14+ deparses TRIM(x) as 'TRIM(BOTH FROM x)', older versions as 'btrim(x)')
+            normalized_markers = ('trim(both from underlying_ticker)', 'btrim(underlying_ticker', 'btrim((underlying_ticker')
+            if existing_definition is not None and not (any(marker in existing_definition.lower() for marker in normalized_markers)
+                                                        and 'double precision' in existing_definition.lower()):
+                connection.execute(sql_text("DROP MATERIALIZED VIEW options_daily_ticker_summary;"))
+                print("Dropped outdated materialized view 'options_daily_ticker_summary'.")
+            # Tickers are trimmed/upper-cased like the dashboard does, so 'nvda ' and 'NVDA' land in one row
+            connection.execute(sql_text("""
+            CREATE MATERIALIZED VIEW IF NOT EXISTS options_daily_ticker_summary AS
+            SELECT data_date, UPPER(TRIM(underlying_ticker)) AS underlying_ticker,
+                   SUM(premium_usd::double precision) AS total_prem,
+                   SUM(CASE WHEN UPPER(TRIM(option_type)) = 'CALL' THEN premium_usd::double precision ELSE 0 END) AS call_prem,
+                   SUM(CASE WHEN UPPER(TRIM(option_type)) = 'PUT' THEN premium_usd::double precision ELSE 0 END) AS put_prem,
+                   SUM(CASE WHEN UPPER(TRIM(sentiment)) = 'BULLISH' THEN premium_usd::double precision ELSE 0 END) AS bull_prem,
+                   SUM(CASE WHEN UPPER(TRIM(sentiment)) = 'BEARISH' THEN premium_usd::double precision ELSE 0 END) AS bear_prem,
+                   MAX(market_cap_ingested) AS mcap
+            FROM options_activity
+            GROUP BY data_date, UPPER(TRIM(underlying_ticker));
+            """))
+            # Unique index is required for REFRESH ... CONCURRENTLY and serves the dashboard's date-range filter
+            connection.execute(sql_text("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_daily_ticker_summary_date_ticker
+            ON options_daily_ticker_summary (data_date, underlying_ticker);
+            """))
+            print("Materialized view 'options_daily_ticker_summary' checked/created successfully.")
+            connection.commit()
+    except Exception as e:
+        print(f"Error creating daily ticker summary view: {e}")
+        raise
+
+def analyze_options_activity_table(engine): # Takes SQLAlchemy engine
+    """Updates planner statistics after new data is loaded so the date/ticker index gets used."""
+    try:
+        with engine.connect() as connection:
+            connection.execute(sql_text("ANALYZE options_activity;"))
+            connection.commit()
+        print("Analyzed table 'options_activity'.")
+    except Exception as e:
+        print(f"Error analyzing options_activity: {e}")
+
+def refresh_daily_ticker_summary_view(engine): # Takes SQLAlchemy engine
+    """Refreshes the daily summary view without blocking dashboard reads."""
+    try:
+        with engine.connect() as connection:
+            connection.execute(sql_text("REFRESH MATERIALIZED VIEW CONCURRENTLY options_daily_ticker_summary;"))
+            connection.commit()
+        print("Refreshed materialized view 'options_daily_ticker_summary'.")
+    except Exception as e:
+        print(f"Error refreshing daily ticker summary view: {e}")
+
 def delete_data_for_date(engine, target_date_str): # Takes SQLAlchemy engine
     """Deletes existing data for a specific date."""
     try:
@@ -296,6 +357,7 @@ def main_automated_ingestion():
         db_engine = create_engine(db_engine_url)
         print("SQLAlchemy engine created successfully.")
         create_options_activity_table(db_engine) 
+        create_daily_ticker_summary_view(db_engine)
     except Exception as e:
         print(f"Failed to create SQLAlchemy engine or initial table: {e}")
         return
@@ -461,6 +523,10 @@ def main_automated_ingestion():
             except Exception as e: print(f"Error ingesting data for {data_date_str_for_db}: {e}")
         else: print(f"No data in final_ingest_df for {target_date_str_for_sheet} to load.")
 
+    if processed_count > 0:
+        analyze_options_activity_table(db_engine)
+        refresh_daily_ticker_summary_view(db_engine)
+
     print(f"\nScript finished. Processed and attempted ingestion for {processed_count} date(s).")
 
             